@@ -2,8 +2,13 @@ import re
 import os
 from pathlib import Path
 import asyncio
+import time
+import random
+import hashlib
 import typing
 import json # 新增导入 for JSON持久化
+import aiohttp
+from collections import OrderedDict
 
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register
@@ -15,35 +20,84 @@ from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import Aioc
 from .utils import (
     get_temp_media_dir,
     download_media,
+    MediaTooLargeError,
     get_mime_type,
     file_to_base64,
+    file_sha256,
     cleanup_temp_files,
     plugin_logger,
-    call_gemini_api
+    call_gemini_api,
+    upload_gemini_file,
+    delete_gemini_file
 )
 
 # 从新创建的适配器文件中导入处理函数
 from .tool_adapter import process_tool_response_from_history
 
+# 引用消息中媒体段的占位文本模板，参数为 (序号, URL)
+_ERR_DOWNLOAD_TMPL = "[引用的图片%d，下载失败，URL: %s]"
+_ERR_B64_TMPL = "[引用的图片%d，Base64编码失败，URL: %s]"
+_IMG_URL_TMPL = "[引用的图片%d URL: %s]"
+_RECORD_URL_TMPL = "[引用的语音%d URL: %s (内容未转录)]"
+_VIDEO_URL_TMPL = "[引用的视频%d URL: %s ()]"
+
+# /tps sm 命令接受的开关取值
+_TRUTHY_STATUS = frozenset({"on", "true", "enable", "1"})
+_FALSY_STATUS = frozenset({"off", "false", "disable", "0"})
+
+# understand_media_from_reply 可处理的媒体文件大小上限及可直接发送给 Gemini 的语音 MIME 类型
+_MAX_MEDIA_BYTES = 20 << 20
+_AUDIO_MIME_WHITELIST = frozenset({"audio/mpeg", "audio/mp3", "audio/wav", "audio/ogg", "audio/flac", "audio/aac"})
+
+def _media_text_part(tmpl: str, seg_idx: int, media_url: str) -> dict:
+    return {"type": "text", "text": tmpl % (seg_idx + 1, media_url)}
+
 
 @register("astrbot_plugin_tool_prompts", "PluginDeveloper", "aiocqhttp 一个LLM工具调用和媒体链接处理插件", "0.4.2", "https://github.com/slot181/astrbot_plugin_tool_prompts") # 版本号更新
 class ToolCallNotifierPlugin(Star):
+    # 引用消息包裹文本，只有昵称部分随请求变化
+    _QUOTE_PREFIX_TMPL = "用户 {sender} 引用了 {quoted} 的消息内容如下:\n\"\"\"\n"
+    _QUOTE_SUFFIX = "\n\"\"\""
+    _QUOTE_SUFFIX_STRIPPED = _QUOTE_SUFFIX.strip()
+    # 跨请求缓存的引用图片 data URI 数量上限
+    _IMAGE_DATA_URI_CACHE_SIZE = 32
+    # data URI 体积随图片大小变化，除条目数外再按总字节数限制；单条过大的直接不缓存
+    _IMAGE_DATA_URI_CACHE_MAX_BYTES = 32 << 20
+    _IMAGE_DATA_URI_CACHE_MAX_ENTRY_BYTES = 4 << 20
+    # 被引用消息详情 (get_msg) 的缓存有效期（秒）
+    _REPLIED_MSG_CACHE_TTL = 30.0
+    # Gemini 媒体理解结果的缓存条目上限
+    _GEMINI_RESPONSE_CACHE_SIZE = 128
+    # 跟踪工具响应处理状态的会话数上限
+    _MAX_TRACKED_SESSIONS = 4096
+
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
+        self._plugin_name = getattr(getattr(self, 'metadata', None), 'name', None) or "astrbot_plugin_tool_prompts"
         self.temp_media_dir = None
         self._cleanup_task = None 
+        self._http_session: aiohttp.ClientSession | None = None # 首次下载时惰性创建，复用连接池
+        self._aiocq_client = None # 非 AiocqhttpMessageEvent 事件时从平台适配器获取的客户端，首次获取后缓存
+        self._image_data_uri_cache: OrderedDict[str, str] = OrderedDict() # key: 图片URL, value: data URI，LRU 淘汰
+        self._image_data_uri_cache_bytes = 0 # 缓存中所有 data URI 的总长度
+        self._config_save_lock = asyncio.Lock()
+        self._replied_msg_cache: OrderedDict[int, tuple[float, dict]] = OrderedDict() # key: message_id, value: (获取时间, 消息详情)
+        self._replied_msg_inflight: dict[int, asyncio.Task] = {} # 同一 message_id 的并发请求合并为一次 get_msg
+        self._gemini_response_cache: OrderedDict[str, tuple[float, str]] = OrderedDict() # key: 内容哈希, value: (过期时间, 回复文本)
+        self._media_inflight: dict[tuple, asyncio.Task] = {} # key: (message_id, 提示), value: 正在执行的媒体理解任务
+        self._history_parse_cache: OrderedDict[str, tuple[str, list]] = OrderedDict() # key: session_id, value: (原始历史字符串, 解析结果)，由 tool_adapter 维护
         # self.processed_tool_call_ids = set() # 旧的全局处理记录，将被替换
-        self.session_processed_indices = {}  # key: session_id, value: set of processed original_indices
-        self.session_last_history_length = {} # key: session_id, value: last known history length for reset detection
+        # 两者按会话最近活跃顺序排列，超过 _MAX_TRACKED_SESSIONS 时淘汰最久未活跃的会话
+        self.session_processed_indices: OrderedDict[str, set] = OrderedDict()  # key: session_id, value: set of processed original_indices
+        self.session_last_history_length: OrderedDict[str, int] = OrderedDict() # key: session_id, value: last known history length for reset detection
+        self.session_scan_cursor: OrderedDict[str, int] = OrderedDict() # key: session_id, value: 此索引之前的历史条目均已检查完毕
+        self.session_scan_fingerprint: OrderedDict[str, str] = OrderedDict() # key: session_id, value: 游标前一条历史条目的指纹，用于发现历史被改写
 
         log_level_str = self.config.get("log_level", "INFO").upper()
         plugin_logger.setLevel(log_level_str)
         
-        plugin_name_for_path = "astrbot_plugin_tool_prompts"
-
-        base_data_path = Path("./data/plugins_data") / plugin_name_for_path
-        
+        base_data_path = Path("./data/plugins_data") / self._plugin_name
         self.plugin_base_data_path = base_data_path # 存储插件基础数据路径
         self.state_file_path = self.plugin_base_data_path / "processed_state.json"
         self._load_processed_state() # 加载持久化的状态
@@ -60,10 +114,7 @@ class ToolCallNotifierPlugin(Star):
                 plugin_logger.info(f"临时媒体目录已初始化: {self.temp_media_dir.resolve()}")
                 initial_cleanup_minutes = self.config.get("temp_file_cleanup_minutes", 60)
                 if initial_cleanup_minutes > 0:
-                    plugin_logger.info(f"插件初始化：执行一次性临时文件清理，目录: {self.temp_media_dir}, 清理周期: {initial_cleanup_minutes} 分钟。")
-                    cleanup_temp_files(self.temp_media_dir, initial_cleanup_minutes)
-                
-                if initial_cleanup_minutes > 0:
+                    # 首次清理由定时任务在启动时于线程中执行，避免阻塞插件加载
                     self._cleanup_task = asyncio.create_task(self._periodic_cleanup_task(initial_cleanup_minutes))
                     plugin_logger.info(f"已启动定时清理任务，每 {initial_cleanup_minutes} 分钟执行一次。")
                 else:
@@ -78,13 +129,17 @@ class ToolCallNotifierPlugin(Star):
         self.gemini_api_key = self.config.get("gemini_api_key", None)
         self.gemini_model_name_for_media = self.config.get("gemini_model_name_for_media", "gemini-2.0-flash-exp")
         self.gemini_base_url = self.config.get("gemini_base_url", "https://generativelanguage.googleapis.com").rstrip('/')
+        self.gemini_cache_ttl_seconds = self.config.get("gemini_cache_ttl_seconds", 600)
+        self.gemini_use_file_api = self.config.get("gemini_use_file_api", False)
+        # 每条引用消息都要读取，缓存为属性；通过 /tps sm 修改时同步更新（WebUI 修改配置会重载插件）
+        self._multimodal_enabled = bool(self.config.get("enable_multimodal_processing", False))
         
         if not self.gemini_api_key:
             plugin_logger.warning("Gemini API Key 未在插件配置中设置。understand_media_from_reply 工具将无法工作。")
         if not self.gemini_base_url:
             plugin_logger.warning("Gemini Base URL 未在插件配置中设置。understand_media_from_reply 工具将使用默认值或可能失败。")
 
-        plugin_logger.info(f"插件 '{self.metadata.name if hasattr(self, 'metadata') else 'ToolCallNotifierPlugin'}' 初始化完成。")
+        plugin_logger.info(f"插件 '{self._plugin_name}' 初始化完成。")
 
     async def _periodic_cleanup_task(self, cleanup_interval_minutes: int):
         if not self.temp_media_dir or cleanup_interval_minutes <= 0:
@@ -93,17 +148,103 @@ class ToolCallNotifierPlugin(Star):
         
         wait_seconds = cleanup_interval_minutes * 60
         plugin_logger.info(f"定时清理任务已启动，每 {cleanup_interval_minutes} 分钟 (即 {wait_seconds} 秒) 清理一次目录: {self.temp_media_dir}")
+        try:
+            plugin_logger.info(f"插件初始化：执行一次性临时文件清理，目录: {self.temp_media_dir}, 清理周期: {cleanup_interval_minutes} 分钟。")
+            await asyncio.to_thread(cleanup_temp_files, self.temp_media_dir, cleanup_interval_minutes)
+        except asyncio.CancelledError:
+            plugin_logger.info("定时清理任务已被取消。")
+            return
+        except Exception as e:
+            plugin_logger.error(f"初始临时文件清理失败: {e}", exc_info=True)
+        # 按单调时钟的截止时间调度，清理本身的耗时不会累积成漂移；出错时指数退避并加入随机抖动
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_seconds
+        backoff = 0.0
         while True:
             try:
-                await asyncio.sleep(wait_seconds)
-                plugin_logger.info(f"定时清理任务：开始执行临时文件清理。")
-                cleanup_temp_files(self.temp_media_dir, cleanup_interval_minutes)
+                await asyncio.sleep(max(0.0, deadline - loop.time()))
+                plugin_logger.info("定时清理任务：开始执行临时文件清理。")
+                # 目录扫描与删除均为阻塞的文件系统调用，放到线程中执行以免阻塞事件循环
+                await asyncio.to_thread(cleanup_temp_files, self.temp_media_dir, cleanup_interval_minutes)
+                backoff = 0.0
+                deadline += wait_seconds
+                # 清理耗时过长时跳过已错过的周期
+                now = loop.time()
+                while deadline <= now:
+                    deadline += wait_seconds
             except asyncio.CancelledError:
                 plugin_logger.info("定时清理任务已被取消。")
                 break
             except Exception as e:
                 plugin_logger.error(f"定时清理任务在执行过程中发生错误: {e}", exc_info=True)
-                await asyncio.sleep(60)
+                backoff = min(300.0, backoff * 2 if backoff else 30.0)
+                deadline = loop.time() + backoff + random.uniform(0, backoff * 0.1)
+
+    async def _get_msg_cached(self, client, message_id) -> typing.Any:
+        """获取被引用消息详情。短时间内同一 message_id 只调用一次 get_msg，并发请求共享同一次调用。"""
+        message_id = int(message_id)
+        cached = self._replied_msg_cache.get(message_id)
+        if cached and time.monotonic() - cached[0] < self._REPLIED_MSG_CACHE_TTL:
+            return cached[1]
+
+        # 并发请求共享同一个任务（与 _media_inflight 相同），任务结束后才移除，
+        # 保证同一时刻每个 message_id 至多有一次 get_msg 在执行
+        task = self._replied_msg_inflight.get(message_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_replied_msg(client, message_id))
+            self._replied_msg_inflight[message_id] = task
+            task.add_done_callback(lambda _: self._replied_msg_inflight.pop(message_id, None))
+        # shield：某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    async def _fetch_replied_msg(self, client, message_id: int) -> typing.Any:
+        """调用 get_msg 并在返回有效结果时写入缓存。"""
+        detail = await client.api.call_action('get_msg', message_id=message_id)
+        if isinstance(detail, dict):
+            now = time.monotonic()
+            self._replied_msg_cache.pop(message_id, None)
+            self._replied_msg_cache[message_id] = (now, detail)
+            # 按插入顺序淘汰已过期的条目
+            while self._replied_msg_cache:
+                oldest_ts = next(iter(self._replied_msg_cache.values()))[0]
+                if now - oldest_ts < self._REPLIED_MSG_CACHE_TTL:
+                    break
+                self._replied_msg_cache.popitem(last=False)
+        return detail
+
+    def _get_aiocq_client(self, event: AstrMessageEvent) -> typing.Any:
+        """获取 aiocqhttp 客户端。优先使用事件自带的 bot，否则从平台适配器获取并缓存。"""
+        if isinstance(event, AiocqhttpMessageEvent):
+            return event.bot
+        if self._aiocq_client is None:
+            platform_adapter = self.context.get_platform(filter.PlatformAdapterType.AIOCQHTTP)
+            if platform_adapter:
+                get_client = getattr(platform_adapter, 'get_client', None)
+                self._aiocq_client = get_client() if get_client else getattr(platform_adapter, 'client', None)
+        return self._aiocq_client
+
+    @staticmethod
+    def _extract_reply_id(message_chain) -> typing.Any:
+        """返回消息链中第一个 Reply 段的 message_id，没有引用或无法确定 ID 时返回 None。"""
+        reply_seg = next((s for s in message_chain if isinstance(s, Comp.Reply)), None)
+        if reply_seg is None:
+            return None
+        segment_data = getattr(reply_seg, 'data', None)
+        # 保留原始类型（通常已是 int），只在调用 get_msg 时转换，避免 str/int 往返
+        raw_id = (segment_data.get('id') if isinstance(segment_data, dict) else None) or getattr(reply_seg, 'id', None)
+        if raw_id is None or raw_id == "":
+            plugin_logger.warning("找到Reply段，但无法确定其message_id。段内容: %s", reply_seg)
+            return None
+        return raw_id
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        """获取插件共享的 aiohttp 会话，必须在事件循环内调用。"""
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(
+                # 引用图片多来自同一 QQ 图床，限制单主机并发，避免突发请求被限流
+                connector=aiohttp.TCPConnector(limit=16, limit_per_host=6, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+        return self._http_session
 
     @filter.llm_tool(name="understand_media_from_reply")
     async def understand_media_from_reply(self, event: AstrMessageEvent, prompt: str) -> typing.AsyncGenerator[Comp.BaseMessageComponent, None]:
@@ -117,7 +258,7 @@ class ToolCallNotifierPlugin(Star):
         Args:
             prompt(string): 用户提供的关于如何理解或回应媒体内容的提示。”
         '''
-        plugin_logger.info(f"LLM工具 'understand_media_from_reply' 被调用，提示: {prompt}")
+        plugin_logger.info("LLM工具 'understand_media_from_reply' 被调用，提示: %s", prompt)
 
         if not self.gemini_api_key:
             plugin_logger.error("understand_media_from_reply: Gemini API Key 未配置。")
@@ -129,40 +270,43 @@ class ToolCallNotifierPlugin(Star):
             yield event.plain_result("错误：插件临时目录未正确初始化，无法处理媒体文件。")
             return
 
-        if event.get_platform_name() != "aiocqhttp":
-            yield event.plain_result("错误：此工具目前仅支持 QQ 平台（aiocqhttp）。")
+        # 与 on_llm_request_handler 一致：先做 Reply 检查，再判断平台
+        reply_message_id = self._extract_reply_id(event.message_obj.message)
+        if reply_message_id is None:
+            yield event.plain_result("错误：此工具需要引用一条消息才能工作。")
             return
 
-        raw_message_chain = event.message_obj.message
-        reply_message_id_str = None
-        for segment in raw_message_chain:
-            if isinstance(segment, Comp.Reply):
-                reply_message_id_str = str(segment.data.get('id')) if hasattr(segment, 'data') and isinstance(segment.data, dict) else str(getattr(segment, 'id', None))
-                break
-        
-        if not reply_message_id_str:
-            yield event.plain_result("错误：此工具需要引用一条消息才能工作。")
+        if event.get_platform_name() != "aiocqhttp":
+            yield event.plain_result("错误：此工具目前仅支持 QQ 平台（aiocqhttp）。")
             return
 
+        # 同一条引用消息、同一提示的并发调用共享一次下载与 Gemini 调用
+        inflight_key = (reply_message_id, prompt)
+        task = self._media_inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.create_task(self._understand_media(event, reply_message_id, prompt))
+            self._media_inflight[inflight_key] = task
+            task.add_done_callback(lambda _: self._media_inflight.pop(inflight_key, None))
+        else:
+            plugin_logger.info("understand_media_from_reply: 相同请求正在处理中，等待其结果。ID: %s", reply_message_id)
+        # shield：发起者被取消时任务继续执行，其他等待者仍能拿到结果
+        yield event.plain_result(await asyncio.shield(task))
+
+    async def _understand_media(self, event: AstrMessageEvent, reply_message_id, prompt: str) -> str:
+        """下载引用消息中的视频或语音并调用 Gemini 理解，返回要回复给用户的文本（含错误提示）。"""
+        downloaded_file_path = None
+        uploaded_file_name = None
         try:
-            client = None
-            if isinstance(event, AiocqhttpMessageEvent):
-                client = event.bot
-            else:
-                platform_adapter = self.context.get_platform(filter.PlatformAdapterType.AIOCQHTTP)
-                if platform_adapter: client = getattr(platform_adapter, 'client', getattr(platform_adapter, 'get_client', lambda: None)())
-
+            client = self._get_aiocq_client(event)
             if not client:
                 plugin_logger.error("understand_media_from_reply: 无法获取 aiocqhttp 客户端。")
-                yield event.plain_result("错误：无法连接到 QQ 平台，请检查插件或 AstrBot 配置。")
-                return
+                return "错误：无法连接到 QQ 平台，请检查插件或 AstrBot 配置。"
 
-            replied_message_detail = await client.api.call_action('get_msg', message_id=int(reply_message_id_str))
+            replied_message_detail = await self._get_msg_cached(client, reply_message_id)
             
             if not (isinstance(replied_message_detail, dict) and 'message' in replied_message_detail):
-                plugin_logger.warning(f"understand_media_from_reply: 获取引用消息详情失败或格式不符。ID: {reply_message_id_str}")
-                yield event.plain_result("错误：无法获取被引用的消息详情。")
-                return
+                plugin_logger.warning("understand_media_from_reply: 获取引用消息详情失败或格式不符。ID: %s", reply_message_id)
+                return "错误：无法获取被引用的消息详情。"
 
             replied_segments = replied_message_detail.get('message', [])
             media_url = None
@@ -176,80 +320,108 @@ class ToolCallNotifierPlugin(Star):
                 if seg_type == 'video' and url:
                     media_url = url
                     media_type_for_gemini = "video/mp4"
-                    plugin_logger.info(f"understand_media_from_reply: 在引用消息中找到视频: {media_url}")
+                    plugin_logger.info("understand_media_from_reply: 在引用消息中找到视频: %s", media_url)
                     break 
                 elif seg_type == 'record' and url:
                     media_url = url
                     media_type_for_gemini = "audio/mp3"
-                    plugin_logger.info(f"understand_media_from_reply: 在引用消息中找到语音: {media_url}")
+                    plugin_logger.info("understand_media_from_reply: 在引用消息中找到语音: %s", media_url)
                     break
 
             if not media_url or not media_type_for_gemini:
-                yield event.plain_result("错误：引用的消息中未找到支持的视频或语音文件，或者文件URL无效。")
-                return
+                return "错误：引用的消息中未找到支持的视频或语音文件，或者文件URL无效。"
 
-            downloaded_file_path = await download_media(media_url, self.temp_media_dir, "gemini_media_")
+            try:
+                downloaded_file_path = await download_media(media_url, self.temp_media_dir, "gemini_media_", session=self._get_http_session(), max_bytes=_MAX_MEDIA_BYTES)
+            except MediaTooLargeError:
+                return f"错误：引用的媒体文件大小超过20MB限制，无法处理。"
             if not downloaded_file_path:
                 plugin_logger.error(f"understand_media_from_reply: 下载媒体文件失败: {media_url}")
-                yield event.plain_result(f"错误：无法下载引用的媒体文件: {media_url}")
-                return
-
-            try:
-                file_size = downloaded_file_path.stat().st_size
-                max_size_bytes = 20 * 1024 * 1024 
-                if file_size > max_size_bytes:
-                    plugin_logger.warning(f"understand_media_from_reply: 文件 {downloaded_file_path} 过大 ({file_size} bytes > {max_size_bytes} bytes)。")
-                    yield event.plain_result(f"错误：引用的媒体文件大小超过20MB限制，无法处理。")
-                    if downloaded_file_path.exists():
-                        downloaded_file_path.unlink()
-                    return
-            except Exception as e_stat:
-                plugin_logger.error(f"understand_media_from_reply: 检查文件大小时出错: {downloaded_file_path}, {e_stat}", exc_info=True)
-                yield event.plain_result("错误：检查媒体文件大小时发生内部错误。")
-                if downloaded_file_path.exists():
-                    downloaded_file_path.unlink()
-                return
-
-            actual_mime_type = get_mime_type(downloaded_file_path)
+                return f"错误：无法下载引用的媒体文件: {media_url}"
+
+            # 以下文件系统与编码操作均为阻塞调用，放到线程中执行以免阻塞事件循环
+            # 提前返回时临时文件统一由 finally 清理
+            # MIME 探测与内容哈希互不依赖，启用结果缓存时在两个线程中并行执行
+            if self.gemini_cache_ttl_seconds > 0:
+                actual_mime_type, content_digest = await asyncio.gather(
+                    asyncio.to_thread(get_mime_type, downloaded_file_path),
+                    asyncio.to_thread(file_sha256, downloaded_file_path),
+                )
+            else:
+                actual_mime_type = await asyncio.to_thread(get_mime_type, downloaded_file_path)
+                content_digest = None
             if media_type_for_gemini == "audio/mp3" and actual_mime_type and "audio" in actual_mime_type:
-                 if actual_mime_type not in ["audio/mpeg", "audio/mp3", "audio/wav", "audio/ogg", "audio/flac", "audio/aac"]:
+                 if actual_mime_type not in _AUDIO_MIME_WHITELIST:
                      plugin_logger.warning(f"understand_media_from_reply: 下载的语音文件MIME类型为 {actual_mime_type}，将尝试作为 audio/mp3 发送给Gemini。")
                  else:
                      media_type_for_gemini = actual_mime_type
             elif not actual_mime_type:
                  plugin_logger.warning(f"understand_media_from_reply: 无法检测下载文件的MIME类型: {downloaded_file_path}。将使用预设的 {media_type_for_gemini}")
 
-            base64_content = file_to_base64(downloaded_file_path)
-            if not base64_content:
-                plugin_logger.error(f"understand_media_from_reply: 文件转 Base64 失败: {downloaded_file_path}")
-                yield event.plain_result("错误：无法处理下载的媒体文件（Base64编码失败）。")
-                return
-            
             gemini_model = self.gemini_model_name_for_media
-            plugin_logger.info(f"understand_media_from_reply: 使用模型 '{gemini_model}' 调用 Gemini API。")
+            cache_key = None
+            if content_digest:
+                cache_key = hashlib.sha256(b'|'.join((
+                    content_digest, gemini_model.encode(), media_type_for_gemini.encode(), prompt.encode()
+                ))).hexdigest()
+                cached = self._gemini_response_cache.get(cache_key)
+                if cached and cached[0] > time.monotonic():
+                    self._gemini_response_cache.move_to_end(cache_key)
+                    plugin_logger.info("understand_media_from_reply: 命中缓存，跳过 Gemini API 调用。")
+                    return cached[1]
+
+            # 启用 File API 时直接上传原始文件，省去 Base64 编码；上传失败则回退到内联数据
+            file_uri = None
+            if self.gemini_use_file_api:
+                uploaded = await upload_gemini_file(self.gemini_base_url, self.gemini_api_key, downloaded_file_path, media_type_for_gemini, self._get_http_session())
+                if uploaded:
+                    file_uri, uploaded_file_name = uploaded
+                else:
+                    plugin_logger.warning("understand_media_from_reply: File API 上传失败，回退为内联 Base64 数据。")
+
+            base64_content = None
+            if not file_uri:
+                base64_content = await asyncio.to_thread(file_to_base64, downloaded_file_path, as_bytes=True)
+                if not base64_content:
+                    plugin_logger.error(f"understand_media_from_reply: 文件转 Base64 失败: {downloaded_file_path}")
+                    return "错误：无法处理下载的媒体文件（Base64编码失败）。"
+            
+            plugin_logger.info("understand_media_from_reply: 使用模型 '%s' 调用 Gemini API。", gemini_model)
             
-            api_response_text = await call_gemini_api(
+            api_ok, api_response_text = await call_gemini_api(
                 base_url=self.gemini_base_url,
                 api_key=self.gemini_api_key,
                 model_name=gemini_model,
                 mime_type=media_type_for_gemini,
                 base64_data=base64_content,
-                user_prompt=prompt
+                user_prompt=prompt,
+                session=self._get_http_session(),
+                file_uri=file_uri
             )
 
-            if api_response_text:
-                yield event.plain_result(api_response_text)
+            if api_ok:
+                # 只缓存真正解析出的模型回复；限流、网络错误等失败文本不能在 TTL 内被重放
+                if cache_key:
+                    self._gemini_response_cache.pop(cache_key, None)
+                    self._gemini_response_cache[cache_key] = (time.monotonic() + self.gemini_cache_ttl_seconds, api_response_text)
+                    if len(self._gemini_response_cache) > self._GEMINI_RESPONSE_CACHE_SIZE:
+                        self._gemini_response_cache.popitem(last=False)
+                return api_response_text
             else:
-                yield event.plain_result("错误：调用 Gemini API 理解媒体失败，或未返回有效文本。")
+                return api_response_text or "错误：调用 Gemini API 理解媒体失败，或未返回有效文本。"
 
         except Exception as e:
             plugin_logger.error(f"understand_media_from_reply: 处理过程中发生错误: {e}", exc_info=True)
-            yield event.plain_result(f"处理引用媒体时发生内部错误: {str(e)}")
+            return f"处理引用媒体时发生内部错误: {str(e)}"
         finally:
-            if 'downloaded_file_path' in locals() and downloaded_file_path and downloaded_file_path.exists():
+            if uploaded_file_name:
+                # 文件只用于本次请求，生成完成后即删除，避免堆积占用 File API 存储配额
+                await delete_gemini_file(self.gemini_base_url, self.gemini_api_key, uploaded_file_name, self._get_http_session())
+            if downloaded_file_path:
                 try:
-                    downloaded_file_path.unlink()
-                    plugin_logger.debug(f"understand_media_from_reply: 已清理临时文件 {downloaded_file_path}")
+                    # missing_ok：文件可能已被定时清理删除，省去一次 exists() 的 stat 调用
+                    await asyncio.to_thread(downloaded_file_path.unlink, missing_ok=True)
+                    plugin_logger.debug("understand_media_from_reply: 已清理临时文件 %s", downloaded_file_path)
                 except Exception as e_clean:
                     plugin_logger.error(f"understand_media_from_reply: 清理临时文件失败 {downloaded_file_path}: {e_clean}")
 
@@ -259,9 +431,9 @@ class ToolCallNotifierPlugin(Star):
         
         if resp.role == "tool" and resp.tools_call_name:
             plugin_logger.info("LLM响应处理器：检测到工具调用。")
-            for tool_name in resp.tools_call_name:
-                message = f"正在调用 {tool_name} 工具中……"
-                await event.send(event.plain_result(message))
+            # 同一轮的多个工具调用合并为一条消息发送，减少平台适配器往返
+            message = "\n".join(f"正在调用 {tool_name} 工具中……" for tool_name in resp.tools_call_name)
+            await event.send(event.plain_result(message))
             return 
 
     @filter.after_message_sent(priority=0)
@@ -270,95 +442,143 @@ class ToolCallNotifierPlugin(Star):
 
         await process_tool_response_from_history(self, event)
 
-    async def _prepare_multimodal_parts(self, replied_message_segments: list) -> list:
-        parts = []
-        multimodal_processing_enabled = self.config.get("enable_multimodal_processing", False)
-
-        if multimodal_processing_enabled:
-            plugin_logger.info("多模态处理已启用。")
-        else:
-            plugin_logger.info("多模态处理已禁用。")
-
+    async def _fetch_image_data_uri(self, media_url: str, download_semaphore: asyncio.Semaphore) -> tuple[str | None, str | None]:
+        """下载单张引用图片并编码为 data URI。返回 (data_uri, 失败原因)，失败原因为 "download" 或 "base64"。"""
+        cached_uri = self._image_data_uri_cache.get(media_url)
+        if cached_uri is not None:
+            self._image_data_uri_cache.move_to_end(media_url)
+            return cached_uri, None
+        async with download_semaphore:
+            downloaded_file = await download_media(media_url, self.temp_media_dir, "img_", session=self._get_http_session())
+        if not downloaded_file:
+            return None, "download"
+        # MIME 探测与 Base64 编码都是阻塞操作，放到线程中执行，多张图片之间也能并行
+        mime_type = await asyncio.to_thread(get_mime_type, downloaded_file) or "image/jpeg"
+        base64_data = await asyncio.to_thread(file_to_base64, downloaded_file)
+        if not base64_data:
+            return None, "base64"
+        data_uri = f"data:{mime_type};base64,{base64_data}"
+        if len(data_uri) <= self._IMAGE_DATA_URI_CACHE_MAX_ENTRY_BYTES:
+            # 并发请求可能已写入同一 URL，先移除旧值以保持字节计数准确
+            previous_uri = self._image_data_uri_cache.pop(media_url, None)
+            if previous_uri is not None:
+                self._image_data_uri_cache_bytes -= len(previous_uri)
+            self._image_data_uri_cache[media_url] = data_uri
+            self._image_data_uri_cache_bytes += len(data_uri)
+            while len(self._image_data_uri_cache) > self._IMAGE_DATA_URI_CACHE_SIZE or \
+                  self._image_data_uri_cache_bytes > self._IMAGE_DATA_URI_CACHE_MAX_BYTES:
+                _, evicted_uri = self._image_data_uri_cache.popitem(last=False)
+                self._image_data_uri_cache_bytes -= len(evicted_uri)
+        return data_uri, None
+
+    @staticmethod
+    def _image_parts_from_result(seg_idx: int, media_url: str, data_uri: str | None, failure: str | None) -> list:
+        if failure == "download":
+            return [_media_text_part(_ERR_DOWNLOAD_TMPL, seg_idx, media_url)]
+        if failure == "base64":
+            return [_media_text_part(_ERR_B64_TMPL, seg_idx, media_url)]
+        return [
+            {"type": "image_url", "image_url": {"url": data_uri}},
+            _media_text_part(_IMG_URL_TMPL, seg_idx, media_url),
+        ]
+
+    @staticmethod
+    def _build_multimodal_content(processed_parts: list, head: str, tail: str) -> list:
+        """单次遍历拼装多模态消息内容：连续文本段以空格连接，图片两侧的文本（含首尾包裹文本）以换行合并为一个文本部分。"""
+        content = []
+        lines = [head]
+        words = []
+        for part_data in processed_parts:
+            if part_data["type"] == "text":
+                if text := part_data["text"].strip():
+                    words.append(text)
+            elif part_data["type"] == "image_url":
+                if words:
+                    lines.append(" ".join(words))
+                    words = []
+                if lines:
+                    content.append({"type": "text", "text": "\n".join(lines)})
+                    lines = []
+                content.append(part_data)
+        if words:
+            lines.append(" ".join(words))
+        lines.append(tail)
+        content.append({"type": "text", "text": "\n".join(lines)})
+        return content
+
+    async def _prepare_multimodal_parts(self, replied_message_segments: list, multimodal_processing_enabled: bool) -> tuple[list, bool]:
+        """按原顺序生成引用消息的内容部分，返回 (parts, 是否包含图片部分)。"""
+        plugin_logger.debug("多模态处理%s。", "已启用" if multimodal_processing_enabled else "已禁用")
+
+        # 第一遍：按原顺序记录每个段的结果，需要下载的图片以任务形式占位并同时开始下载
+        # 同一条引用消息中重复出现的图片 URL 只下载、编码一次
+        slots = []
+        url_tasks: dict[str, asyncio.Task] = {}
+        download_semaphore = asyncio.Semaphore(max(1, int(self.config.get("multimodal_max_concurrent_downloads", 5))))
         for seg_idx, seg_data in enumerate(replied_message_segments):
             seg_type = seg_data.get('type')
             seg_content_data = seg_data.get('data', {})
             media_url = seg_content_data.get('url')
 
             if seg_type == 'text' and seg_content_data.get('text'):
-                parts.append({"type": "text", "text": seg_content_data['text'].strip()})
+                slots.append([{"type": "text", "text": seg_content_data['text'].strip()}])
             elif seg_type == 'image' and media_url:
                 if multimodal_processing_enabled:
                     if not self.temp_media_dir:
                         plugin_logger.warning(f"图片多模态处理跳过：临时目录未初始化。URL: {media_url}")
-                        parts.append({"type": "text", "text": f"[引用的图片{seg_idx+1}，下载失败，URL: {media_url}]"})
+                        slots.append([_media_text_part(_ERR_DOWNLOAD_TMPL, seg_idx, media_url)])
                         continue
-                    downloaded_file = await download_media(media_url, self.temp_media_dir, "img_")
-                    if downloaded_file:
-                        mime_type = get_mime_type(downloaded_file) or "image/jpeg"
-                        base64_data = file_to_base64(downloaded_file)
-                        if base64_data:
-                            parts.append({
-                                "type": "image_url",
-                                "image_url": {"url": f"data:{mime_type};base64,{base64_data}"}
-                            })
-                            parts.append({"type": "text", "text": f"[引用的图片{seg_idx+1} URL: {media_url}]"})
-                        else:
-                            parts.append({"type": "text", "text": f"[引用的图片{seg_idx+1}，Base64编码失败，URL: {media_url}]"})
-                    else:
-                        parts.append({"type": "text", "text": f"[引用的图片{seg_idx+1}，下载失败，URL: {media_url}]"})
+                    task = url_tasks.get(media_url)
+                    if task is None:
+                        task = url_tasks[media_url] = asyncio.create_task(self._fetch_image_data_uri(media_url, download_semaphore))
+                    slots.append((seg_idx, media_url, task))
                 else: 
-                    parts.append({"type": "text", "text": f"[引用的图片{seg_idx+1} URL: {media_url}]"})
+                    slots.append([_media_text_part(_IMG_URL_TMPL, seg_idx, media_url)])
             elif seg_type in ['record', 'video'] and media_url:
-                media_kind = "语音" if seg_type == 'record' else "视频"
-                parts.append({"type": "text", "text": f"[引用的{media_kind}{seg_idx+1} URL: {media_url} ({'内容未转录' if seg_type == 'record' else ''})]"})
-        return parts
+                slots.append([_media_text_part(_RECORD_URL_TMPL if seg_type == 'record' else _VIDEO_URL_TMPL, seg_idx, media_url)])
+
+        # 第二遍：等待所有下载完成后按原顺序拼装
+        if url_tasks:
+            await asyncio.gather(*url_tasks.values())
+        parts = []
+        has_image = False
+        for slot in slots:
+            if isinstance(slot, tuple):
+                seg_idx, media_url, task = slot
+                data_uri, failure = task.result()
+                has_image = has_image or failure is None
+                parts.extend(self._image_parts_from_result(seg_idx, media_url, data_uri, failure))
+            else:
+                parts.extend(slot)
+        return parts, has_image
 
     @filter.on_llm_request(priority=1)
     async def on_llm_request_handler(self, event: AstrMessageEvent, req: ProviderRequest):
         """LLM请求前：处理QQ引用消息，整合到请求上下文。"""
-        if event.get_platform_name() != "aiocqhttp":
+        # 绝大多数消息不含引用，先做最便宜的 Reply 检查再判断平台
+        reply_message_id = self._extract_reply_id(event.message_obj.message)
+        if reply_message_id is None:
             return
-
-        raw_message_chain = event.message_obj.message
-        reply_message_id_str = None
-        for segment in raw_message_chain:
-            if isinstance(segment, Comp.Reply):
-                if hasattr(segment, 'data') and isinstance(segment.data, dict) and 'id' in segment.data:
-                    reply_message_id_str = str(segment.data['id'])
-                elif hasattr(segment, 'id'):
-                    reply_message_id_str = str(segment.id)
-                if reply_message_id_str:
-                    plugin_logger.debug(f"LLM请求预处理：检测到QQ引用消息，ID: {reply_message_id_str}")
-                else:
-                    plugin_logger.warning(f"LLM请求预处理：找到Reply段，但无法确定其message_id。段内容: {segment}")
-                break
-
-        if not reply_message_id_str:
+        if event.get_platform_name() != "aiocqhttp":
             return
+        plugin_logger.debug("LLM请求预处理：检测到QQ引用消息，ID: %s", reply_message_id)
 
-        plugin_logger.info(f"LLM请求预处理：处理引用消息 ID: {reply_message_id_str}")
+        plugin_logger.info("LLM请求预处理：处理引用消息 ID: %s", reply_message_id)
         try:
-            client = None
-            if isinstance(event, AiocqhttpMessageEvent):
-                client = event.bot
-            else:
-                platform_adapter = self.context.get_platform(filter.PlatformAdapterType.AIOCQHTTP)
-                if platform_adapter and hasattr(platform_adapter, 'get_client'):
-                    client = platform_adapter.get_client()
-                elif platform_adapter and hasattr(platform_adapter, 'client'):
-                     client = platform_adapter.client
+            client = self._get_aiocq_client(event)
             if not client:
                 plugin_logger.error("LLM请求预处理：无法获取到 aiocqhttp 客户端实例。")
                 return
 
-            replied_message_detail = await client.api.call_action('get_msg', message_id=int(reply_message_id_str))
+            replied_message_detail = await self._get_msg_cached(client, reply_message_id)
             
             if isinstance(replied_message_detail, dict) and 'message_id' in replied_message_detail and 'message' in replied_message_detail:
                 original_sender_nickname = replied_message_detail.get('sender', {}).get('card') or replied_message_detail.get('sender', {}).get('nickname', '未知用户')
                 replied_segments = replied_message_detail.get('message', [])
                 if not isinstance(replied_segments, list): replied_segments = []
                 
-                processed_parts = await self._prepare_multimodal_parts(replied_segments)
+                multimodal_processing_enabled = self._multimodal_enabled
+                processed_parts, has_image = await self._prepare_multimodal_parts(replied_segments, multimodal_processing_enabled)
                 
                 if processed_parts:
                     if req.contexts is None: req.contexts = []
@@ -366,42 +586,21 @@ class ToolCallNotifierPlugin(Star):
                     if req.contexts and req.contexts[0].get('role') == 'system':
                         system_prompt_entry = req.contexts.pop(0)
                     
-                    multimodal_processing_enabled = self.config.get("enable_multimodal_processing", False)
-                    should_form_multimodal_request = multimodal_processing_enabled and any(p.get("type") == "image_url" for p in processed_parts)
+                    should_form_multimodal_request = multimodal_processing_enabled and has_image
                     
                     actual_quoted_contexts = []
-                    prefix = f"用户 {event.get_sender_name()} 引用了 {original_sender_nickname} 的消息内容如下:\n\"\"\"\n"
-                    suffix = "\n\"\"\""
+                    prefix = self._QUOTE_PREFIX_TMPL.format(sender=event.get_sender_name(), quoted=original_sender_nickname)
 
                     if should_form_multimodal_request:
-                        content_parts_for_llm = []
-                        if prefix.strip(): content_parts_for_llm.append({"type": "text", "text": prefix.strip()})
-                        current_text_batch = []
-                        for part_data in processed_parts:
-                            if part_data.get("type") == "text":
-                                current_text_batch.append(part_data.get("text","").strip())
-                            elif part_data.get("type") == "image_url":
-                                if current_text_batch:
-                                    combined_text = " ".join([s for s in current_text_batch if s])
-                                    if combined_text: content_parts_for_llm.append({"type": "text", "text": combined_text})
-                                    current_text_batch = []
-                                content_parts_for_llm.append(part_data)
-                        if current_text_batch:
-                            combined_text = " ".join([s for s in current_text_batch if s])
-                            if combined_text: content_parts_for_llm.append({"type": "text", "text": combined_text})
-                        if suffix.strip(): content_parts_for_llm.append({"type": "text", "text": suffix.strip()})
-                        if content_parts_for_llm:
-                             actual_quoted_contexts.append({"role": "user", "content": content_parts_for_llm})
+                        merged_parts = self._build_multimodal_content(processed_parts, prefix.strip(), self._QUOTE_SUFFIX_STRIPPED)
+                        if merged_parts:
+                             actual_quoted_contexts.append({"role": "user", "content": merged_parts})
                     else: 
-                        all_text_from_parts = []
-                        for part_data in processed_parts:
-                            if part_data.get("type") == "text":
-                                all_text_from_parts.append(part_data.get("text","").strip())
-                            elif part_data.get("type") == "image_url":
-                                 all_text_from_parts.append(f"[引用的图片 URL: {part_data.get('image_url',{}).get('url','未知URL')}]")
-                        full_quoted_text = " ".join([s for s in all_text_from_parts if s]).strip()
+                        # 未启用多模态时 _prepare_multimodal_parts 只产出文本部分；启用且含图片时走上面的分支
+                        # 各段已 strip 且滤掉空串，拼接结果无需再 strip
+                        full_quoted_text = " ".join(filter(None, (part_data["text"].strip() for part_data in processed_parts)))
                         if full_quoted_text:
-                            actual_quoted_contexts.append({"role": "user", "content": prefix + full_quoted_text + suffix})
+                            actual_quoted_contexts.append({"role": "user", "content": "".join((prefix, full_quoted_text, self._QUOTE_SUFFIX))})
 
                     if actual_quoted_contexts:
                         new_contexts = []
@@ -409,11 +608,11 @@ class ToolCallNotifierPlugin(Star):
                         new_contexts.extend(req.contexts) 
                         new_contexts.extend(actual_quoted_contexts) 
                         req.contexts = new_contexts
-                        plugin_logger.info(f"LLM请求预处理：已整合引用内容到 contexts。")
+                        plugin_logger.info("LLM请求预处理：已整合引用内容到 contexts。")
                     else:
                         if system_prompt_entry and req.contexts : req.contexts.insert(0, system_prompt_entry) 
             else:
-                plugin_logger.warning(f"LLM请求预处理：调用 get_msg 失败或数据格式不符合预期: {replied_message_detail}")
+                plugin_logger.warning("LLM请求预处理：调用 get_msg 失败或数据格式不符合预期: %s", replied_message_detail)
         except Exception as e:
             plugin_logger.error(f"LLM请求预处理：处理QQ引用消息时发生错误: {e}", exc_info=True)
 
@@ -430,10 +629,10 @@ class ToolCallNotifierPlugin(Star):
         reply_msg = ""
         new_status = None
 
-        if normalized_status in ["on", "true", "enable", "1"]:
+        if normalized_status in _TRUTHY_STATUS:
             new_status = True
             reply_msg = "引用消息的多模态处理已启用。"
-        elif normalized_status in ["off", "false", "disable", "0"]:
+        elif normalized_status in _FALSY_STATUS:
             new_status = False
             reply_msg = "引用消息的多模态处理已禁用。"
         else:
@@ -441,9 +640,12 @@ class ToolCallNotifierPlugin(Star):
             await event.send(event.plain_result(reply_msg))
             return
 
-        self.config["enable_multimodal_processing"] = new_status
         try:
-            self.config.save_config()
+            # 配置写盘在线程中执行；加锁保证连续的开关命令按顺序写入
+            async with self._config_save_lock:
+                self.config["enable_multimodal_processing"] = new_status
+                self._multimodal_enabled = new_status
+                await asyncio.to_thread(self.config.save_config)
             plugin_logger.info(f"多模态处理状态已由管理员 {event.get_sender_name()} 设置为: {new_status}。")
             await event.send(event.plain_result(reply_msg))
         except Exception as e:
@@ -453,12 +655,11 @@ class ToolCallNotifierPlugin(Star):
     @toolprompts_settings_group.command("get_multimodal_status", alias={"gms"})
     async def get_multimodal_status(self, event: AstrMessageEvent):
         """获取当前引用消息的多模态处理状态 (/tps gms)。"""
-        multimodal_enabled = self.config.get("enable_multimodal_processing", False)
-        status_str = "已启用" if multimodal_enabled else "已禁用"
+        status_str = "已启用" if self._multimodal_enabled else "已禁用"
         await event.send(event.plain_result(f"当前引用消息的多模态处理状态为: {status_str}"))
 
     async def terminate(self):
-        plugin_logger.info(f"插件 '{self.metadata.name if hasattr(self, 'metadata') else 'ToolCallNotifierPlugin'}' 正在终止...")
+        plugin_logger.info(f"插件 '{self._plugin_name}' 正在终止...")
         if self._cleanup_task and not self._cleanup_task.done():
             plugin_logger.info("正在取消定时清理任务...")
             self._cleanup_task.cancel()
@@ -469,16 +670,23 @@ class ToolCallNotifierPlugin(Star):
             except Exception as e:
                 plugin_logger.error(f"等待定时清理任务取消时发生错误: {e}", exc_info=True)
         
+        for task in list(self._media_inflight.values()):
+            task.cancel()
+
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+            plugin_logger.info("共享 HTTP 会话已关闭。")
+
         if self.temp_media_dir:
             cleanup_minutes = self.config.get("temp_file_cleanup_minutes", 60)
             if cleanup_minutes > 0:
                 plugin_logger.info(f"插件终止：执行最终临时文件清理，目录: {self.temp_media_dir}, 清理周期: {cleanup_minutes} 分钟。")
-                cleanup_temp_files(self.temp_media_dir, cleanup_minutes) 
+                await asyncio.to_thread(cleanup_temp_files, self.temp_media_dir, cleanup_minutes)
             else:
                  plugin_logger.info("插件终止：最终临时文件清理已禁用。")
         
         self._save_processed_state() # 在终止前保存状态
-        plugin_logger.info(f"插件 '{self.metadata.name if hasattr(self, 'metadata') else 'ToolCallNotifierPlugin'}' 已终止。")
+        plugin_logger.info(f"插件 '{self._plugin_name}' 已终止。")
 
     def _load_processed_state(self):
         """从JSON文件加载已处理的会话状态。"""
@@ -488,24 +696,45 @@ class ToolCallNotifierPlugin(Star):
                     state_data = json.load(f)
                 
                 # 将加载的列表转换回集合
-                self.session_processed_indices = {
-                    session_id: set(indices) 
+                self.session_processed_indices = OrderedDict(
+                    (session_id, set(indices))
                     for session_id, indices in state_data.get("session_processed_indices", {}).items()
-                }
-                self.session_last_history_length = state_data.get("session_last_history_length", {})
+                )
+                self.session_last_history_length = OrderedDict(state_data.get("session_last_history_length", {}))
+                self.session_scan_cursor = OrderedDict(state_data.get("session_scan_cursor", {}))
+                self.session_scan_fingerprint = OrderedDict(state_data.get("session_scan_fingerprint", {}))
+                self._trim_session_state()
                 plugin_logger.info(f"已成功从 {self.state_file_path} 加载已处理的会话状态。")
             except json.JSONDecodeError:
                 plugin_logger.error(f"解析状态文件 {self.state_file_path} 失败。将使用空状态初始化。", exc_info=True)
-                self.session_processed_indices = {}
-                self.session_last_history_length = {}
+                self.session_processed_indices = OrderedDict()
+                self.session_last_history_length = OrderedDict()
+                self.session_scan_cursor = OrderedDict()
+                self.session_scan_fingerprint = OrderedDict()
             except Exception as e:
                 plugin_logger.error(f"加载状态文件 {self.state_file_path} 时发生未知错误。将使用空状态初始化。", exc_info=True)
-                self.session_processed_indices = {}
-                self.session_last_history_length = {}
+                self.session_processed_indices = OrderedDict()
+                self.session_last_history_length = OrderedDict()
+                self.session_scan_cursor = OrderedDict()
+                self.session_scan_fingerprint = OrderedDict()
         else:
             plugin_logger.info(f"状态文件 {self.state_file_path} 未找到。将使用空状态初始化。")
-            self.session_processed_indices = {}
-            self.session_last_history_length = {}
+            self.session_processed_indices = OrderedDict()
+            self.session_last_history_length = OrderedDict()
+            self.session_scan_cursor = OrderedDict()
+            self.session_scan_fingerprint = OrderedDict()
+
+    def _touch_session_state(self, session_id: str):
+        """标记会话为最近活跃（淘汰由 _trim_session_state 在写入新会话记录之后进行）。"""
+        for state in (self.session_processed_indices, self.session_last_history_length, self.session_scan_cursor, self.session_scan_fingerprint):
+            if session_id in state:
+                state.move_to_end(session_id)
+
+    def _trim_session_state(self):
+        """淘汰超出上限的最久未活跃会话的处理状态。"""
+        for state in (self.session_processed_indices, self.session_last_history_length, self.session_scan_cursor, self.session_scan_fingerprint):
+            while len(state) > self._MAX_TRACKED_SESSIONS:
+                state.popitem(last=False)
 
     def _save_processed_state(self):
         """将已处理的会话状态保存到JSON文件。"""
@@ -529,10 +758,12 @@ class ToolCallNotifierPlugin(Star):
             }
             state_data = {
                 "session_processed_indices": serializable_indices,
-                "session_last_history_length": self.session_last_history_length
+                "session_last_history_length": self.session_last_history_length,
+                "session_scan_cursor": self.session_scan_cursor,
+                "session_scan_fingerprint": self.session_scan_fingerprint
             }
             with open(self.state_file_path, 'w', encoding='utf-8') as f:
                 json.dump(state_data, f, ensure_ascii=False, indent=4)
-            plugin_logger.info(f"已处理的会话状态已成功保存到 {self.state_file_path}")
+            plugin_logger.info("已处理的会话状态已成功保存到 %s", self.state_file_path)
         except Exception as e:
             plugin_logger.error(f"保存状态到文件 {self.state_file_path} 失败。", exc_info=True)
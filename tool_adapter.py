@@ -1,5 +1,7 @@
+import hashlib
 import json
 import os
+import re
 from astrbot.api.event import AstrMessageEvent
 from astrbot.api.star import Star
 import astrbot.api.message_components as Comp
@@ -17,19 +19,73 @@ except ImportError:
         plugin_logger.addHandler(handler)
         plugin_logger.setLevel(logging.INFO)
 
-from .utils import store_media_in_plugin_data # 导入新的辅助函数
+from .utils import store_media_in_plugin_data, json_loads # 导入新的辅助函数；json_loads 在安装 orjson 时使用 orjson 解析
 
 # 目标工具ID常量化
 SD_IMAGE_GEN_PREFIX = "sd_image_gen-generate_sd_image"
 OPENAPI_SPEECH_PREFIX = "openapi_integrator_mcp-generate_speech"
 GEMINI_EDIT_IMAGE_PREFIX = "gemini_integrator_mcp-gemini_edit_image" # 新增
 
+# 匹配内容的第一个非空白字符，用于在完整解析 JSON 前做廉价的类型预判
+_FIRST_NON_SPACE_RE = re.compile(r'\s*(\S)')
+
+def _json_starts_with(content: str, opener: str) -> bool:
+    """判断内容去掉前导空白后是否以指定字符 ('{' 或 '[') 开头，只检查开头部分。"""
+    m = _FIRST_NON_SPACE_RE.match(content)
+    return m is not None and m.group(1) == opener
+
+# 缓存解析结果的会话数上限；每个会话只保留最近一次的原始历史字符串及其解析结果
+_HISTORY_PARSE_CACHE_SIZE = 16
+
+
+def _latest_turn_start(history_list: list) -> int:
+    """返回最近一条用户消息的索引，即当前这一轮对话在历史中的起点（没有用户消息时为 0）。"""
+    for index in range(len(history_list) - 1, -1, -1):
+        entry = history_list[index]
+        if isinstance(entry, dict) and entry.get("role") == "user":
+            return index
+    return 0
+
+
+def _history_entry_fingerprint(entry) -> str:
+    """计算单条历史条目的指纹，用于确认游标所在位置的条目没有被改写。
+    条目内容可能是数 MB 的 Base64 数据，只取角色、工具名、内容长度及开头片段，不序列化整条条目。"""
+    if not isinstance(entry, dict):
+        return type(entry).__name__
+    content = entry.get("content")
+    if isinstance(content, str):
+        content_sig = f"{len(content)}:{content[:256]}"
+    elif isinstance(content, list):
+        content_sig = f"list:{len(content)}"
+    else:
+        content_sig = type(content).__name__
+    signature = f"{entry.get('role')}\x00{entry.get('tool_call_id')}\x00{content_sig}"
+    return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+
+def _set_scan_cursor(plugin_instance: Star, session_id: str, history_list: list, index: int):
+    """更新会话的扫描游标，并记录游标前一条目的指纹。"""
+    session_scan_cursor = getattr(plugin_instance, 'session_scan_cursor', None)
+    if session_scan_cursor is None:
+        return
+    session_scan_cursor[session_id] = index
+    session_scan_fingerprint = getattr(plugin_instance, 'session_scan_fingerprint', None)
+    if session_scan_fingerprint is not None:
+        if 0 < index <= len(history_list):
+            session_scan_fingerprint[session_id] = _history_entry_fingerprint(history_list[index - 1])
+        else:
+            session_scan_fingerprint.pop(session_id, None)
+
 # async def _handle_gemini_web_search(...) # 函数已移除
 
 async def _handle_gemini_edit_image(event: AstrMessageEvent, tool_content_str: str, tool_name: str, plugin_instance: Star):
     """处理 gemini_edit_image 工具的响应，发送图片。"""
     try:
-        tool_content_json = json.loads(tool_content_str)
+        # 工具返回纯文本错误信息时无需完整解析，也避免记录解析异常的堆栈
+        if not _json_starts_with(tool_content_str, '{'):
+            plugin_logger.warning(f"工具适配器：[{tool_name}] 内容不是 JSON 对象，跳过处理。")
+            return False
+        tool_content_json = json_loads(tool_content_str)
         local_path = tool_content_json.get("localPath")
         cf_image_url = tool_content_json.get("cfImageUrl") # Cloudflare URL
         media_segment = None
@@ -38,7 +94,7 @@ async def _handle_gemini_edit_image(event: AstrMessageEvent, tool_content_str: s
 
         if local_path and os.path.exists(local_path):
             plugin_logger.info(f"工具适配器：[{tool_name}] 检测到本地路径 '{local_path}'。")
-            if hasattr(plugin_instance, 'plugin_base_data_path') and plugin_instance.plugin_base_data_path:
+            if getattr(plugin_instance, 'plugin_base_data_path', None):
                 stored_path = await store_media_in_plugin_data(local_path, plugin_instance.plugin_base_data_path)
                 if stored_path:
                     plugin_logger.info(f"工具适配器：[{tool_name}] 图片已存至插件数据目录 '{stored_path}'，将使用此路径发送。")
@@ -68,7 +124,10 @@ async def _handle_gemini_edit_image(event: AstrMessageEvent, tool_content_str: s
 
 async def _handle_sd_image_gen(event: AstrMessageEvent, tool_content_str: str, tool_call_id: str, plugin_instance: Star):
     try:
-        tool_content_list = json.loads(tool_content_str)
+        if not _json_starts_with(tool_content_str, '['):
+            plugin_logger.warning(f"工具适配器：[{tool_call_id}] 内容不是 JSON 列表，跳过处理。")
+            return False
+        tool_content_list = json_loads(tool_content_str)
         if not isinstance(tool_content_list, list) or not tool_content_list:
             plugin_logger.warning(f"工具适配器：[{tool_call_id}] 内容不是有效列表或列表为空。")
             return False
@@ -80,7 +139,7 @@ async def _handle_sd_image_gen(event: AstrMessageEvent, tool_content_str: str, t
 
         if path and os.path.exists(path):
             plugin_logger.info(f"工具适配器：[{tool_call_id}] 原始本地路径 '{path}'。")
-            if hasattr(plugin_instance, 'plugin_base_data_path') and plugin_instance.plugin_base_data_path:
+            if getattr(plugin_instance, 'plugin_base_data_path', None):
                 stored_path = await store_media_in_plugin_data(path, plugin_instance.plugin_base_data_path)
                 if stored_path:
                     plugin_logger.info(f"工具适配器：[{tool_call_id}] 图片已存至插件数据目录 '{stored_path}'，将使用此路径发送。")
@@ -111,7 +170,10 @@ async def _handle_sd_image_gen(event: AstrMessageEvent, tool_content_str: str, t
 
 async def _handle_openapi_speech(event: AstrMessageEvent, tool_content_str: str, tool_call_id: str, plugin_instance: Star):
     try:
-        tool_content_list = json.loads(tool_content_str)
+        if not _json_starts_with(tool_content_str, '['):
+            plugin_logger.warning(f"工具适配器：[{tool_call_id}] 内容不是 JSON 列表，跳过处理。")
+            return False
+        tool_content_list = json_loads(tool_content_str)
         if not isinstance(tool_content_list, list) or not tool_content_list:
             plugin_logger.warning(f"工具适配器：[{tool_call_id}] 内容不是有效列表或列表为空。")
             return False
@@ -122,7 +184,7 @@ async def _handle_openapi_speech(event: AstrMessageEvent, tool_content_str: str,
 
         if path and os.path.exists(path):
             plugin_logger.info(f"工具适配器：[{tool_call_id}] 原始本地路径 '{path}'。")
-            if hasattr(plugin_instance, 'plugin_base_data_path') and plugin_instance.plugin_base_data_path:
+            if getattr(plugin_instance, 'plugin_base_data_path', None):
                 stored_path = await store_media_in_plugin_data(path, plugin_instance.plugin_base_data_path)
                 if stored_path:
                     plugin_logger.info(f"工具适配器：[{tool_call_id}] 语音已存至插件数据目录 '{stored_path}'，将使用此路径发送。")
@@ -155,43 +217,77 @@ async def process_tool_response_from_history(plugin_instance: Star, event: AstrM
     如果找到，则根据工具类型提取内容并单独发送。
     使用基于会话ID和历史记录索引的方式来跟踪已处理的条目。
     """
+    # 状态有变化时只在结束时保存一次，避免每条消息多次同步写入状态文件
+    state_dirty = False
+    save_processed_state = None
     try:
         if not hasattr(plugin_instance, 'session_processed_indices') or \
            not hasattr(plugin_instance, 'session_last_history_length'):
             plugin_logger.warning("工具适配器：插件实例缺少会话处理状态跟踪属性 (session_processed_indices 或 session_last_history_length)。")
             return
         
+        # 一次性解析可选的状态保存方法，避免在扫描过程中重复 hasattr
+        save_processed_state = getattr(plugin_instance, '_save_processed_state', None)
+        touch_session_state = getattr(plugin_instance, '_touch_session_state', None)
+
         conversation_manager = plugin_instance.context.conversation_manager
         session_id = await conversation_manager.get_curr_conversation_id(event.unified_msg_origin)
         
         if not session_id:
             plugin_logger.debug("工具适配器：无法获取当前会话ID，跳过处理。")
             return
+        if touch_session_state:
+            touch_session_state(session_id)
         
         conversation = await conversation_manager.get_conversation(event.unified_msg_origin, session_id)
         if not conversation or not conversation.history:
-            plugin_logger.debug(f"工具适配器：会话 {session_id} 不存在或历史记录为空。")
+            plugin_logger.debug("工具适配器：会话 %s 不存在或历史记录为空。", session_id)
             # 如果会话历史为空，也可能意味着重置，确保清除旧的长度记录
             if plugin_instance.session_last_history_length.get(session_id, 0) > 0:
                  plugin_logger.info(f"工具适配器：会话 {session_id} 历史记录为空，可能已重置。清除已处理索引。")
                  plugin_instance.session_processed_indices[session_id] = set()
+                 _set_scan_cursor(plugin_instance, session_id, [], 0)
             plugin_instance.session_last_history_length[session_id] = 0
             return
 
-        history_list = []
-        try:
-            history_list = json.loads(conversation.history)
-            if not isinstance(history_list, list):
-                plugin_logger.warning(f"工具适配器：会话 {session_id} 的历史非列表格式。")
+        # 同一轮对话中每次发送消息都会触发本钩子，而历史往往未变化；
+        # 原始字符串相同时复用上次的解析结果（字符串比较远快于重新解析整段 JSON）
+        history_raw = conversation.history
+        history_parse_cache = getattr(plugin_instance, '_history_parse_cache', None)
+        cached_parse = history_parse_cache.get(session_id) if history_parse_cache is not None else None
+        history_unchanged = False
+        if cached_parse is not None and cached_parse[0] == history_raw:
+            history_list = cached_parse[1]
+            history_unchanged = True
+            history_parse_cache.move_to_end(session_id)
+        else:
+            try:
+                history_list = json_loads(history_raw)
+                if not isinstance(history_list, list):
+                    plugin_logger.warning(f"工具适配器：会话 {session_id} 的历史非列表格式。")
+                    return
+            except json.JSONDecodeError:
+                plugin_logger.error(f"工具适配器：解析会话 {session_id} 的历史JSON失败。", exc_info=True)
                 return
-        except json.JSONDecodeError:
-            plugin_logger.error(f"工具适配器：解析会话 {session_id} 的历史JSON失败。", exc_info=True)
-            return
+            if history_parse_cache is not None:
+                history_parse_cache.pop(session_id, None)
+                history_parse_cache[session_id] = (history_raw, history_list)
+                if len(history_parse_cache) > _HISTORY_PARSE_CACHE_SIZE:
+                    history_parse_cache.popitem(last=False)
         
         current_history_length = len(history_list)
         last_known_length = plugin_instance.session_last_history_length.get(session_id, -1)
 
         processed_indices_for_session = plugin_instance.session_processed_indices.setdefault(session_id, set())
+        # 扫描游标：游标之前的条目均已检查完毕（已处理或无需处理），每次只需检查游标之后新增的条目
+        session_scan_cursor = getattr(plugin_instance, 'session_scan_cursor', None)
+        scan_start_index = session_scan_cursor.get(session_id, 0) if session_scan_cursor is not None else 0
+
+        # 没有任何跟踪记录的会话（新会话，或因长期不活跃被淘汰后重新活跃）：
+        # 更早轮次的工具结果当时已处理过或早已过时，只检查最近一轮对话，避免把旧结果重新发送一遍
+        if last_known_length == -1 and session_scan_cursor is not None and session_id not in session_scan_cursor:
+            scan_start_index = _latest_turn_start(history_list)
+            _set_scan_cursor(plugin_instance, session_id, history_list, scan_start_index)
 
         # 会话重置检测：如果当前历史长度显著小于上次记录的长度
         # (且上次长度不是初始值-1，也不是0立即增长到非0)
@@ -201,27 +297,39 @@ async def process_tool_response_from_history(plugin_instance: Star, event: AstrM
         if last_known_length != -1 and current_history_length < last_known_length:
             plugin_logger.info(f"工具适配器：检测到会话 {session_id} 可能已重置 (当前长度 {current_history_length} < 上次记录长度 {last_known_length})。正在清除该会话的已处理索引记录。")
             processed_indices_for_session.clear()
-            if hasattr(plugin_instance, '_save_processed_state'):
-                plugin_instance._save_processed_state() # 保存状态
+            scan_start_index = 0
+            _set_scan_cursor(plugin_instance, session_id, history_list, 0)
+            state_dirty = True
         
         # 只有当长度实际变化时才更新和保存，或者如果它是第一次被记录
         if plugin_instance.session_last_history_length.get(session_id) != current_history_length:
             plugin_instance.session_last_history_length[session_id] = current_history_length
-            if hasattr(plugin_instance, '_save_processed_state'):
-                plugin_instance._save_processed_state() # 保存状态
+            state_dirty = True
         
         if not history_list:
-            plugin_logger.debug(f"工具适配器：会话 {session_id} 历史记录为空（重置后或初始）。")
+            plugin_logger.debug("工具适配器：会话 %s 历史记录为空（重置后或初始）。", session_id)
             return
 
-        plugin_logger.debug(f"工具适配器：检查会话 {session_id}。历史长度: {current_history_length}。已处理索引: {processed_indices_for_session}")
+        # 游标只适用于追加式增长的历史：若历史在长度不减的情况下被改写（例如截断后又追加），
+        # 游标前一条目会与记录的指纹不符，此时游标已不可信，回退为完整扫描
+        if 0 < scan_start_index and not history_unchanged:
+            session_scan_fingerprint = getattr(plugin_instance, 'session_scan_fingerprint', None)
+            expected_fingerprint = session_scan_fingerprint.get(session_id) if session_scan_fingerprint is not None else None
+            if scan_start_index > current_history_length or \
+               (expected_fingerprint is not None and expected_fingerprint != _history_entry_fingerprint(history_list[scan_start_index - 1])):
+                plugin_logger.info(f"工具适配器：会话 {session_id} 的历史在扫描游标 {scan_start_index} 之前已被改写，回退为完整扫描。")
+                processed_indices_for_session.clear()
+                scan_start_index = 0
+                _set_scan_cursor(plugin_instance, session_id, history_list, 0)
 
-        # 从后向前遍历 (最新的条目优先)
-        for i in range(current_history_length):
-            original_index = current_history_length - 1 - i # 实际在 history_list 中的索引
+        plugin_logger.debug("工具适配器：检查会话 %s。历史长度: %s。扫描起点: %s。已处理索引: %s", session_id, current_history_length, scan_start_index, processed_indices_for_session)
+
+        # 从后向前遍历 (最新的条目优先)，只检查游标之后的条目
+        for original_index in range(current_history_length - 1, scan_start_index - 1, -1):
             message_entry = history_list[original_index]
             
-            plugin_logger.debug(f"工具适配器：会话 {session_id}，检查索引 {original_index}: {message_entry}") # 这条日志之前已添加
+            # 惰性格式化：条目可能包含大段内容，仅在 DEBUG 级别实际输出时才转换为字符串
+            plugin_logger.debug("工具适配器：会话 %s，检查索引 %s: %s", session_id, original_index, message_entry)
 
             if isinstance(message_entry, dict) and \
                message_entry.get("role") == "tool" and \
@@ -233,12 +341,12 @@ async def process_tool_response_from_history(plugin_instance: Star, event: AstrM
                 tool_content_str = message_entry.get("content")
 
                 if not tool_name_from_history or not tool_content_str or not isinstance(tool_content_str, str):
-                    plugin_logger.debug(f"工具适配器：会话 {session_id}，索引 {original_index}：跳过不完整的工具消息条目。")
+                    plugin_logger.debug("工具适配器：会话 %s，索引 %s：跳过不完整的工具消息条目。", session_id, original_index)
                     continue
 
                 # 使用 original_index 和 session_id 来唯一确定一个历史条目是否被处理过
                 if original_index in processed_indices_for_session:
-                    plugin_logger.debug(f"工具适配器：会话 {session_id}，索引 {original_index} (工具名: {tool_name_from_history}) 已处理过，继续检查更早的条目。")
+                    plugin_logger.debug("工具适配器：会话 %s，索引 %s (工具名: %s) 已处理过，继续检查更早的条目。", session_id, original_index, tool_name_from_history)
                     continue
 
                 handler_function = None
@@ -265,16 +373,27 @@ async def process_tool_response_from_history(plugin_instance: Star, event: AstrM
                     if processed_successfully is True or processed_successfully is False:
                          processed_indices_for_session.add(original_index)
                          plugin_logger.info(f"工具适配器：会话 {session_id}，索引 {original_index} (工具名: {tool_name_from_history}) 已标记为已处理 (处理结果: {processed_successfully})。")
-                         if hasattr(plugin_instance, '_save_processed_state'):
-                            plugin_instance._save_processed_state() # 保存状态
+                         state_dirty = True
                     
                     # 处理完一个就立即返回，等待下一次 after_message_sent 触发
                     # 这保持了每次只发送一个工具结果的行为
                     return 
                 else:
-                    plugin_logger.debug(f"工具适配器：会话 {session_id}，索引 {original_index}：工具名 '{tool_name_from_history}' 未匹配任何已知处理器。")
+                    plugin_logger.debug("工具适配器：会话 %s，索引 %s：工具名 '%s' 未匹配任何已知处理器。", session_id, original_index, tool_name_from_history)
             
-        plugin_logger.debug(f"工具适配器：会话 {session_id} 完成历史记录检查，未找到需要处理的新工具响应。")
+        plugin_logger.debug("工具适配器：会话 %s 完成历史记录检查，未找到需要处理的新工具响应。", session_id)
+        # 游标之后的条目已全部检查完毕：推进游标，游标之前的已处理索引不会再被查询，可以丢弃
+        # 游标本身无需单独保存：丢失时按已保存的状态重新检查这一段即可
+        if session_scan_cursor is not None and scan_start_index != current_history_length:
+            _set_scan_cursor(plugin_instance, session_id, history_list, current_history_length)
+            processed_indices_for_session.clear()
 
     except Exception as e:
         plugin_logger.error(f"工具适配器：在 process_tool_response_from_history (会话 {session_id if 'session_id' in locals() else '未知'}) 中发生未捕获的严重错误: {e}", exc_info=True)
+    finally:
+        # 在本次可能新增会话记录之后再淘汰，保证各状态字典不超过上限
+        trim_session_state = getattr(plugin_instance, '_trim_session_state', None)
+        if trim_session_state:
+            trim_session_state()
+        if state_dirty and save_processed_state:
+            save_processed_state() # 保存状态
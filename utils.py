@@ -1,6 +1,8 @@
 import os
 import time
-import base64
+import binascii
+import hashlib
+import logging
 import mimetypes
 import shutil
 import aiohttp
@@ -28,6 +30,9 @@ except ImportError:
 
 TEMP_MEDIA_DIR_NAME = "temp_media"
 
+# 从 Content-Disposition 头中提取文件名，模块加载时编译一次
+_CONTENT_DISPOSITION_FILENAME_RE = re.compile(r"filename\*?=([^']+''|[^;]+)")
+
 def get_temp_media_dir(plugin_data_dir: Path) -> Path:
     """获取或创建插件的临时媒体存储目录"""
     temp_dir = plugin_data_dir / TEMP_MEDIA_DIR_NAME
@@ -40,8 +45,23 @@ def get_temp_media_dir(plugin_data_dir: Path) -> Path:
             return None # 或者抛出异常
     return temp_dir
 
-async def download_media(url: str, temp_dir: Path, file_name_prefix: str = "downloaded_") -> Path | None:
-    """从URL下载媒体文件到临时目录"""
+class MediaTooLargeError(Exception):
+    """下载的媒体文件超过调用方指定的大小上限。"""
+    def __init__(self, url: str, max_bytes: int):
+        super().__init__(f"媒体文件超过 {max_bytes} 字节上限: {url}")
+        self.url = url
+        self.max_bytes = max_bytes
+
+# 下载时每次从网络读取 64KB，累积到 1MB 再交给线程写盘，避免在事件循环上执行同步写入
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+_DOWNLOAD_FLUSH_SIZE = 1024 * 1024
+
+async def download_media(url: str, temp_dir: Path, file_name_prefix: str = "downloaded_", session: aiohttp.ClientSession | None = None, max_bytes: int | None = None) -> Path | None:
+    """从URL下载媒体文件到临时目录。传入 session 时复用其连接池，否则临时创建一个会话。
+
+    指定 max_bytes 时，Content-Length 超限则不下载，流式下载过程中超限则中止并删除已写入的部分，
+    两种情况均抛出 MediaTooLargeError。
+    """
     if not temp_dir:
         plugin_logger.error("下载媒体失败：临时目录无效或未初始化。")
         return None
@@ -57,15 +77,21 @@ async def download_media(url: str, temp_dir: Path, file_name_prefix: str = "down
                 plugin_logger.error(f"下载前创建临时目录失败: {temp_dir}, 错误: {e_mkdir}")
                 return None
 
-        async with aiohttp.ClientSession() as session:
+        own_session = session is None
+        if own_session:
+            session = aiohttp.ClientSession()
+        try:
             async with session.get(url) as response:
                 response.raise_for_status() # 如果状态码不是 2xx，则抛出异常
+                if max_bytes is not None and response.content_length is not None and response.content_length > max_bytes:
+                    plugin_logger.warning(f"媒体文件 Content-Length ({response.content_length} bytes) 超过上限 {max_bytes} bytes，跳过下载: {url}")
+                    raise MediaTooLargeError(url, max_bytes)
                 
                 # 尝试从URL或Content-Disposition获取文件名和扩展名
                 content_disposition = response.headers.get('Content-Disposition')
                 original_filename = None
                 if content_disposition:
-                    filenames = re.findall("filename\*?=([^']+''|[^;]+)", content_disposition)
+                    filenames = _CONTENT_DISPOSITION_FILENAME_RE.findall(content_disposition)
                     if filenames:
                         fn = filenames[0]
                         if fn.lower().startswith("utf-8''"):
@@ -88,14 +114,31 @@ async def download_media(url: str, temp_dir: Path, file_name_prefix: str = "down
                 filename = f"{file_name_prefix}{safe_base}_{timestamp}{ext if ext else '.tmp'}"
                 
                 file_path = temp_dir / filename
+                total_bytes = 0
+                pending = bytearray()
                 with open(file_path, 'wb') as f:
-                    while True:
-                        chunk = await response.content.read(1024)
-                        if not chunk:
+                    async for chunk in response.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+                        total_bytes += len(chunk)
+                        if max_bytes is not None and total_bytes > max_bytes:
                             break
-                        f.write(chunk)
+                        pending += chunk
+                        if len(pending) >= _DOWNLOAD_FLUSH_SIZE:
+                            data = bytes(pending)
+                            pending.clear()
+                            await asyncio.to_thread(f.write, data)
+                    if pending and (max_bytes is None or total_bytes <= max_bytes):
+                        await asyncio.to_thread(f.write, bytes(pending))
+                if max_bytes is not None and total_bytes > max_bytes:
+                    file_path.unlink(missing_ok=True)
+                    plugin_logger.warning(f"媒体文件下载超过上限 {max_bytes} bytes，已中止并删除部分文件: {url}")
+                    raise MediaTooLargeError(url, max_bytes)
                 plugin_logger.info(f"媒体文件成功下载并保存到: {file_path} (来自URL: {url})")
                 return file_path
+        finally:
+            if own_session:
+                await session.close()
+    except MediaTooLargeError:
+        raise
     except aiohttp.ClientResponseError as e_http:
         plugin_logger.error(f"下载媒体文件HTTP错误 (状态码: {e_http.status}, URL: {url}): {e_http.message}")
         return None
@@ -132,19 +175,41 @@ def get_mime_type(file_path: Path) -> str | None:
             mime_type = "audio/mpeg"
     return mime_type
 
-def file_to_base64(file_path: Path) -> str | None:
-    """将文件内容编码为Base64字符串"""
+# 分块编码的块大小，须为 3 的倍数，保证块之间不会产生填充字符
+_B64_CHUNK_SIZE = 57 * 1024
+
+def file_to_base64(file_path: Path, as_bytes: bool = False) -> str | bytearray | None:
+    """将文件内容编码为Base64字符串（分块读取编码，避免整文件原始字节与编码结果同时驻留内存）
+    
+    as_bytes 为 True 时直接返回 ASCII 字节，省去解码为 str 的一次整体复制。
+    """
     if not file_path or not file_path.is_file():
         plugin_logger.warning(f"无法将文件转为Base64：文件不存在或不是文件 - {file_path}")
         return None
     try:
+        encoded = bytearray()
         with open(file_path, 'rb') as f:
-            encoded_string = base64.b64encode(f.read()).decode('utf-8')
-        return encoded_string
+            while chunk := f.read(_B64_CHUNK_SIZE):
+                encoded += binascii.b2a_base64(chunk, newline=False)
+        return encoded if as_bytes else encoded.decode('ascii')
     except Exception as e:
         plugin_logger.error(f"文件转Base64失败: {file_path}, 错误: {e}", exc_info=True)
         return None
 
+_HASH_CHUNK_SIZE = 64 * 1024
+
+def file_sha256(file_path: Path) -> bytes | None:
+    """分块计算文件内容的 SHA-256 摘要"""
+    try:
+        h = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(_HASH_CHUNK_SIZE):
+                h.update(chunk)
+        return h.digest()
+    except Exception as e:
+        plugin_logger.error(f"计算文件哈希失败: {file_path}, 错误: {e}", exc_info=True)
+        return None
+
 def cleanup_temp_files(temp_dir: Path, max_age_minutes: int):
     """清理临时目录中超过指定时长的文件"""
     if not temp_dir or not temp_dir.is_dir() or max_age_minutes <= 0:
@@ -153,19 +218,21 @@ def cleanup_temp_files(temp_dir: Path, max_age_minutes: int):
         return
 
     plugin_logger.info(f"开始清理临时文件目录: {temp_dir}, 清理周期: {max_age_minutes} 分钟")
-    now = time.time()
+    cutoff = time.time() - max_age_minutes * 60
     cleaned_count = 0
     try:
-        for f in temp_dir.iterdir():
-            if f.is_file():
+        # scandir 的 DirEntry 自带文件类型信息，is_file() 无需额外 stat，stat() 结果也会被缓存
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
                 try:
-                    file_age_seconds = now - f.stat().st_mtime
-                    if file_age_seconds > (max_age_minutes * 60):
-                        f.unlink()
-                        plugin_logger.debug(f"已删除过期临时文件: {f}")
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        plugin_logger.debug("已删除过期临时文件: %s", entry.path)
                         cleaned_count += 1
+                except FileNotFoundError:
+                    pass # 已被其他流程删除
                 except Exception as e_file:
-                    plugin_logger.error(f"删除临时文件失败: {f}, 错误: {e_file}")
+                    plugin_logger.error(f"删除临时文件失败: {entry.path}, 错误: {e_file}")
         if cleaned_count > 0:
             plugin_logger.info(f"临时文件清理完成，共删除 {cleaned_count} 个过期文件。")
         else:
@@ -178,7 +245,15 @@ import re
 import urllib.parse
 import json # 新增导入
 
-async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_type: str, base64_data: str, user_prompt: str) -> str | None:
+# orjson 为可选依赖，安装后用于解析较大的 JSON 响应；其 JSONDecodeError 是 json.JSONDecodeError 的子类
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_type: str, base64_data: str | bytes | bytearray | None, user_prompt: str, session: aiohttp.ClientSession | None = None, file_uri: str | None = None) -> tuple[bool, str | None]:
     """
     调用 Gemini API 来处理媒体文件。
 
@@ -187,19 +262,22 @@ async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_typ
         api_key: Gemini API 密钥。
         model_name: 要使用的 Gemini 模型名称。
         mime_type: 媒体文件的 MIME 类型 (例如 "video/mp4", "audio/mp3")。
-        base64_data: 媒体文件的 Base64 编码数据。
+        base64_data: 媒体文件的 Base64 编码数据，传入字节时直接拼入请求体。
         user_prompt: 用户提供的提示，指导模型如何理解媒体。
+        session: 可选的共享 aiohttp 会话，传入时复用其连接池，否则临时创建一个会话。
+        file_uri: 通过 File API 上传后得到的文件 URI，传入时以 file_data 引用文件，忽略 base64_data。
 
     Returns:
-        从 Gemini API 返回的文本响应，如果失败则返回 None。
+        (是否成功, 文本)。成功时文本为模型返回的内容；失败时文本为可展示给用户的错误说明（可能为 None）。
+        只有成功解析出 candidates[0].content.parts[0].text 时才视为成功。
     """
     if not api_key:
         plugin_logger.error("Gemini API 调用失败：API Key 未配置。")
-        return None
+        return False, None
     
     if not base_url:
         plugin_logger.error("Gemini API 调用失败：Base URL 未配置。")
-        return "错误：Gemini API 基础端点未配置。"
+        return False, "错误：Gemini API 基础端点未配置。"
 
 
     # 确保 base_url 末尾没有斜杠，而路径开头有斜杠
@@ -207,27 +285,38 @@ async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_typ
     api_path = f"/v1beta/models/{model_name}:generateContent"
     api_url = f"{clean_base_url}{api_path}?key={api_key}"
     
-    request_payload = {
-        "contents": [{
-            "parts": [
-                {
-                    "inline_data": {
-                        "mime_type": mime_type,
-                        "data": base64_data
-                    }
-                },
-                {"text": user_prompt}
-            ]
-        }]
-    }
+    if file_uri:
+        request_body = json.dumps({
+            "contents": [{
+                "parts": [
+                    {"file_data": {"mime_type": mime_type, "file_uri": file_uri}},
+                    {"text": user_prompt}
+                ]
+            }]
+        }, ensure_ascii=False).encode()
+    else:
+        # 请求体结构: {"contents": [{"parts": [{"inline_data": {"mime_type", "data"}}, {"text"}]}]}
+        # Base64 字符无需 JSON 转义，直接按字节拼接，避免对数十 MB 的数据再做一次 json 序列化和编码
+        if isinstance(base64_data, str):
+            base64_data = base64_data.encode('ascii')
+        request_body = b''.join((
+            b'{"contents":[{"parts":[{"inline_data":{"mime_type":', json.dumps(mime_type).encode(),
+            b',"data":"', base64_data,
+            b'"}},{"text":', json.dumps(user_prompt, ensure_ascii=False).encode(), b'}]}]}',
+        ))
 
     plugin_logger.info(f"向 Gemini API ({model_name}) 发送请求...")
-    plugin_logger.debug(f"Gemini API 请求体 (数据部分已省略): {json.dumps({'contents': [{'parts': [{'inline_data': {'mime_type': mime_type, 'data': '...'}}, {'text': user_prompt}]}]})}")
+    if plugin_logger.isEnabledFor(logging.DEBUG): # 避免在非 DEBUG 级别下序列化请求体
+        media_part = {'file_data': {'mime_type': mime_type, 'file_uri': file_uri}} if file_uri else {'inline_data': {'mime_type': mime_type, 'data': '...'}}
+        plugin_logger.debug(f"Gemini API 请求体 (数据部分已省略): {json.dumps({'contents': [{'parts': [media_part, {'text': user_prompt}]}]})}")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, json=request_payload) as response:
-                response_json = await response.json()
+        own_session = session is None
+        if own_session:
+            session = aiohttp.ClientSession()
+        try:
+            async with session.post(api_url, data=request_body, headers={"Content-Type": "application/json"}) as response:
+                response_json = json_loads(await response.read())
                 if response.status == 200:
                     plugin_logger.info("Gemini API 请求成功。")
                     # 提取文本内容，根据 Gemini API 的响应结构
@@ -240,8 +329,8 @@ async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_typ
                             if parts and isinstance(parts, list) and len(parts) > 0:
                                 text_response = parts[0].get("text")
                                 if text_response:
-                                    plugin_logger.debug(f"Gemini API 响应文本: {text_response}")
-                                    return str(text_response)
+                                    plugin_logger.debug("Gemini API 响应文本: %s", text_response)
+                                    return True, str(text_response)
                                 else:
                                     plugin_logger.warning("Gemini API 响应中未找到预期的文本内容 (parts[0]['text']缺失)。")
                             else:
@@ -252,44 +341,156 @@ async def call_gemini_api(base_url: str, api_key: str, model_name: str, mime_typ
                         plugin_logger.warning("Gemini API 响应中未找到预期的 'candidates' 列表。")
                     
                     plugin_logger.warning(f"Gemini API 响应结构不符合预期，完整响应: {response_json}")
-                    return f"Gemini API 调用成功，但无法解析响应文本。原始响应: {json.dumps(response_json)}"
+                    return False, f"Gemini API 调用成功，但无法解析响应文本。原始响应: {json.dumps(response_json)}"
 
                 else:
                     plugin_logger.error(f"Gemini API 请求失败，状态码: {response.status}, 响应: {response_json}")
                     error_message = response_json.get("error", {}).get("message", "未知错误")
-                    return f"Gemini API 错误: {error_message}"
+                    return False, f"Gemini API 错误: {error_message}"
+        finally:
+            if own_session:
+                await session.close()
     except aiohttp.ClientError as e:
         plugin_logger.error(f"调用 Gemini API 时发生 aiohttp 客户端错误: {e}", exc_info=True)
-        return f"Gemini API 网络请求错误: {e}"
+        return False, f"Gemini API 网络请求错误: {e}"
     except json.JSONDecodeError as e:
         plugin_logger.error(f"解析 Gemini API 响应时发生 JSON 解码错误: {e}", exc_info=True)
         raw_text = await response.text()
-        return f"Gemini API 响应 JSON 解析错误。原始响应: {raw_text}"
+        return False, f"Gemini API 响应 JSON 解析错误。原始响应: {raw_text}"
     except Exception as e:
         plugin_logger.error(f"调用 Gemini API 时发生未知错误: {e}", exc_info=True)
-        return f"调用 Gemini API 时发生未知错误: {e}"
+        return False, f"调用 Gemini API 时发生未知错误: {e}"
+
+# File API 上传后视频等文件需等待服务端处理完成 (state 变为 ACTIVE) 才能引用
+_GEMINI_FILE_POLL_INTERVAL = 2.0
+_GEMINI_FILE_POLL_TIMEOUT = 120.0
+
+def _json_loads_or_none(data):
+    """解析 JSON，失败时返回 None 而不抛出异常。"""
+    try:
+        return json_loads(data)
+    except ValueError:
+        return None
+
+async def upload_gemini_file(base_url: str, api_key: str, file_path: Path, mime_type: str, session: aiohttp.ClientSession) -> tuple[str, str] | None:
+    """
+    通过 Gemini File API 上传媒体文件，等待其可用后返回 (文件 URI, 文件名)。
+
+    文件以原始字节流式上传，无需 Base64 编码。任何一步失败都返回 None，由调用方回退到内联数据方式。
+    调用方用完后应通过 delete_gemini_file 删除文件，避免占用 File API 存储配额。
+    """
+    clean_base_url = base_url.rstrip('/')
+    upload_url = f"{clean_base_url}/upload/v1beta/files?key={api_key}"
+    file_name = None
+    file_ready = False
+    try:
+        file_size = (await asyncio.to_thread(file_path.stat)).st_size
+        headers = {
+            "X-Goog-Upload-Protocol": "raw",
+            "X-Goog-Upload-Header-Content-Length": str(file_size),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+            "Content-Type": mime_type,
+        }
+        with open(file_path, 'rb') as f:
+            async with session.post(upload_url, data=f, headers=headers) as response:
+                # 不支持 File API 的代理通常返回非 JSON 的 404 页面：先检查状态码，安静地回退到内联数据
+                if response.status != 200:
+                    plugin_logger.warning(f"Gemini File API 上传失败，状态码: {response.status}, 响应: {(await response.text())[:500]}")
+                    return None
+                response_json = _json_loads_or_none(await response.read())
+                if not isinstance(response_json, dict):
+                    plugin_logger.warning("Gemini File API 上传响应不是有效的 JSON 对象。")
+                    return None
+
+        file_info = response_json.get("file") or {}
+        file_uri = file_info.get("uri")
+        file_name = file_info.get("name")
+        if not file_uri or not file_name:
+            plugin_logger.warning(f"Gemini File API 上传响应缺少文件 URI: {response_json}")
+            return None
+
+        deadline = time.monotonic() + _GEMINI_FILE_POLL_TIMEOUT
+        while file_info.get("state", "ACTIVE") == "PROCESSING":
+            if time.monotonic() >= deadline:
+                plugin_logger.warning("Gemini File API 文件处理超时: %s", file_name)
+                return None
+            await asyncio.sleep(_GEMINI_FILE_POLL_INTERVAL)
+            async with session.get(f"{clean_base_url}/v1beta/{file_name}?key={api_key}") as response:
+                if response.status != 200:
+                    plugin_logger.warning(f"查询 Gemini File API 文件状态失败，状态码: {response.status}, 响应: {(await response.text())[:500]}")
+                    return None
+                file_info = _json_loads_or_none(await response.read())
+                if not isinstance(file_info, dict):
+                    plugin_logger.warning("Gemini File API 文件状态响应不是有效的 JSON 对象。")
+                    return None
+
+        if file_info.get("state", "ACTIVE") != "ACTIVE":
+            plugin_logger.warning(f"Gemini File API 文件处理失败: {file_info}")
+            return None
+        plugin_logger.info("媒体文件已通过 Gemini File API 上传: %s", file_uri)
+        file_ready = True
+        return file_uri, file_name
+    except Exception as e:
+        plugin_logger.error(f"通过 Gemini File API 上传文件时出错: {e}", exc_info=True)
+        return None
+    finally:
+        # 已上传但未能投入使用（处理超时、处理失败或查询出错），立即删除
+        if file_name and not file_ready:
+            await delete_gemini_file(base_url, api_key, file_name, session)
+
+async def delete_gemini_file(base_url: str, api_key: str, file_name: str, session: aiohttp.ClientSession) -> bool:
+    """删除通过 File API 上传的文件（file_name 形如 "files/abc123"）。失败只记录日志，返回是否成功。"""
+    delete_url = f"{base_url.rstrip('/')}/v1beta/{file_name}?key={api_key}"
+    try:
+        async with session.delete(delete_url) as response:
+            if response.status != 200:
+                plugin_logger.warning(f"删除 Gemini File API 文件 {file_name} 失败，状态码: {response.status}, 响应: {await response.text()}")
+                return False
+        plugin_logger.debug("已删除 Gemini File API 文件: %s", file_name)
+        return True
+    except Exception as e:
+        plugin_logger.error(f"删除 Gemini File API 文件 {file_name} 时出错: {e}", exc_info=True)
+        return False
+
+_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif')
+_VIDEO_EXTS = ('.mp4', '.mov', '.avi')
+# 根据用户反馈，openapi_integrator_mcp-generate_speech 返回 .mp3
+_AUDIO_EXTS = ('.wav', '.mp3', '.silk', '.amr') # 扩展音频格式支持
+_DOC_EXTS = ('.pdf', '.doc', '.docx', '.txt')
+
+# 扩展名 -> 媒体类型，一次字典查找替代逐个 endswith 比较
+_EXT_TO_KIND = {}
+for _ext in _IMAGE_EXTS: _EXT_TO_KIND[_ext] = 'image'
+for _ext in _VIDEO_EXTS: _EXT_TO_KIND[_ext] = 'video'
+for _ext in _AUDIO_EXTS: _EXT_TO_KIND[_ext] = 'audio'
+for _ext in _DOC_EXTS: _EXT_TO_KIND[_ext] = 'doc'
+del _ext
+
+def _is_http(path_or_url: str) -> bool:
+    """判断是否为 http(s) URL，只对前 8 个字符做小写转换。"""
+    return path_or_url[:8].lower().startswith(('http:', 'https:'))
 
 def _create_media_segment(path_or_url: str):
     """
     根据路径或URL创建合适的 AstrBot 媒体消息段。
     此函数现在位于 utils.py。
+    注意：目前插件内没有任何调用方（工具适配器直接构造消息段），保留仅供兼容。
     """
-    is_url = path_or_url.lower().startswith('http:') or path_or_url.lower().startswith('https:')
-    # 确保 plugin_logger 在此作用域内可用，如果它不是全局定义的（它是全局的）
-    
-    if any(path_or_url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif']):
+    is_url = _is_http(path_or_url)
+    kind = _EXT_TO_KIND.get(os.path.splitext(path_or_url)[1].lower())
+
+    if kind == 'image':
         plugin_logger.debug(f"媒体处理工具：识别为图片: {path_or_url}")
         return Comp.Image.fromURL(path_or_url) if is_url else Comp.Image.fromFileSystem(path_or_url)
-    if any(path_or_url.lower().endswith(ext) for ext in ['.mp4', '.mov', '.avi']):
+    elif kind == 'video':
         plugin_logger.debug(f"媒体处理工具：识别为视频: {path_or_url}")
         return Comp.Video.fromURL(path_or_url) if is_url else Comp.Video.fromFileSystem(path_or_url)
-    # 根据用户反馈，openapi_integrator_mcp-generate_speech 返回 .mp3
-    if any(path_or_url.lower().endswith(ext) for ext in ['.wav', '.mp3', '.silk', '.amr']): # 扩展音频格式支持
+    elif kind == 'audio':
         plugin_logger.debug(f"媒体处理工具：识别为音频: {path_or_url}")
         # Comp.Record 通常需要本地文件路径，如果只有URL可能需要先下载
         # 但 AstrBot 的 Comp.Record 也接受 url 参数
         return Comp.Record(url=path_or_url) if is_url else Comp.Record(file=path_or_url)
-    if any(path_or_url.lower().endswith(ext) for ext in ['.pdf', '.doc', '.docx', '.txt']):
+    elif kind == 'doc':
         plugin_logger.debug(f"媒体处理工具：识别为文档: {path_or_url}")
         return Comp.File(url=path_or_url, name=os.path.basename(path_or_url)) if is_url else Comp.File(file=path_or_url, name=os.path.basename(path_or_url))
     
@@ -313,7 +514,7 @@ async def store_media_in_plugin_data(source_path_str: str, plugin_base_data_path
 
     try:
         source_file = Path(source_path_str)
-        if not source_file.exists() or not source_file.is_file():
+        if not source_file.is_file(): # is_file 已隐含存在性检查，只需一次 stat
             plugin_logger.error(f"存储媒体文件失败：源文件不存在或不是文件 -> {source_path_str}")
             return None
 